@@ -1,5 +1,7 @@
 import cmd
 import getpass
+import os
+import shlex
 
 from client_wrapper import IMAPClientWrapper
 
@@ -9,10 +11,19 @@ class IMAPClientShell(cmd.Cmd):
     prompt = "(IMAP) "
     client: IMAPClientWrapper | None = None
 
+    def postcmd(self, stop: bool, line: str) -> bool:
+        # Пока shell ждет ввода, сервер сообщает об изменениях в папке через IDLE
+        if self.client:
+            self.client.start_idle()
+        return stop
+
     def do_connect(self, arg: str) -> None:
-        server: str = input("Server: ")
-        port: str = input("Port: ")
-        use_ssl: bool = input("Use SSL? (y/n): ").lower() == 'y'
+        args: list[str] = arg.split()
+        server: str = args[0] if len(args) > 0 else input("Server: ")
+        port: str = args[1] if len(args) > 1 else input("Port: ")
+        use_ssl: bool = (args[2] if len(args) > 2 else input("Use SSL? (y/n): ")).lower() == 'y'
+        if self.client:
+            self.client.stop_idle()
         self.client = IMAPClientWrapper(server, port, use_ssl)
         self.client.connect()
 
@@ -20,8 +31,8 @@ class IMAPClientShell(cmd.Cmd):
         if self.client is None:
             print("Not connected. Use 'connect' first.")
             return
-        username: str = input("Username: ")
-        password: str = getpass.getpass("Password: ")
+        username: str = os.environ.get('IMAP_USER') or input("Username: ")
+        password: str = os.environ.get('IMAP_PASS') or getpass.getpass("Password: ")
         self.client.login(username, password)
 
     def do_list(self, arg: str) -> None:
@@ -35,8 +46,14 @@ class IMAPClientShell(cmd.Cmd):
         self.client.select_folder(folder)
 
     def do_fetch(self, arg: str) -> None:
-        download_attachments: bool = '-d' in arg
-        self.client.fetch_emails(download_attachments=download_attachments)
+        try:
+            args: list[str] = shlex.split(arg)
+        except ValueError as e:
+            print(f"Invalid fetch arguments ({e}). Usage: fetch [-d] [criteria...], e.g. fetch FROM \"Bob Smith\"")
+            return
+        download_attachments: bool = '-d' in args
+        criteria: list[str] = [item for item in args if item != '-d']
+        self.client.fetch_emails(download_attachments=download_attachments, criteria=criteria)
 
     def do_logout(self, arg: str) -> None:
         if self.client:
@@ -63,3 +80,21 @@ class IMAPClientShell(cmd.Cmd):
         recipients = input("Recipient emails (comma-separated): ").split(',')
 
         self.client.upload_email(folder, subject, body, recipients, sender)
+
+    def do_batch(self, arg: str) -> None:
+        if not arg:
+            print("Usage: batch <script file>")
+            return
+
+        try:
+            with open(arg, encoding='utf-8') as script:
+                lines: list[str] = script.readlines()
+        except OSError as e:
+            print(f"Cannot read batch file: {e}")
+            return
+
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                print(f"{self.prompt}{line}")
+                self.onecmd(line)
@@ -1,21 +1,153 @@
+import binascii
 import os
+import quopri
+import re
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from dateutil import parser
 from email import message_from_bytes
-from email.header import decode_header
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
 from email import policy
-from email.message import EmailMessage
-from pathlib import Path
+from email.message import EmailMessage, Message
+from functools import lru_cache
+from itertools import islice
 
 from imapclient import IMAPClient
+from imapclient.response_types import BodyData, Envelope
+
+
+# encoded-word из RFC 2047: =?charset?B|Q?text?=
+_ENCODED_WORD = re.compile(r'=\?[^?\s]+\?[bBqQ]\?[^?\s]*\?=')
+
+
+@lru_cache(maxsize=512)
+def _decode(header: str) -> str:
+    # make_header склеивает все фрагменты RFC 2047, а не только первый
+    if not _ENCODED_WORD.search(header):
+        return header
+    try:
+        return str(make_header(decode_header(header)))
+    except (HeaderParseError, LookupError, UnicodeError):
+        return header
+
+
+def _safe_filename(filename: str) -> str | None:
+    # Имя вложения задает отправитель: отбрасываем путь, чтобы файл не записался вне папки
+    name = os.path.basename(filename.replace('\\', '/')).strip()
+    if name in ('', '.', '..'):
+        return
+    return name
+
+
+def _unique_name(name: str, used: set[str]) -> str:
+    # "name (1).ext" для повторов; регистр не учитывается, как в файловых системах Windows и macOS
+    stem, ext = os.path.splitext(name)
+    candidate, number = name, 0
+    while candidate.lower() in used:
+        number += 1
+        candidate = f"{stem} ({number}){ext}"
+    used.add(candidate.lower())
+    return candidate
+
+
+def _format_date(date: datetime) -> str:
+    return date.replace(tzinfo=None, microsecond=0).isoformat(sep=' ')
+
+
+def _batched(items: Iterable[int], size: int) -> Iterator[list[int]]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# Авторизованные сессии по (сервер, пользователь) для повторного login без TLS и LOGIN
+_POOL: dict[tuple[str, str], tuple[IMAPClient, str]] = {}
+
+_SEPARATOR: str = '-' * 40
+
+_WRITE_FLAGS: int = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+_PAYLOAD_CHUNK: int = 64 * 1024
+_BASE64_NOISE = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+@dataclass(slots=True, frozen=True)
+class EnvelopeRow:
+    uid: int
+    sender: str | None
+    subject: str | None
+    date: str | None
+    body: str
+    structure: BodyData
+
+
+def _iter_payload(part: Message) -> Iterator[bytes]:
+    if part.get('Content-Transfer-Encoding', '').strip().lower() != 'base64':
+        data: bytes | None = part.get_payload(decode=True)
+        if data:
+            yield data
+        return
+
+    # Как и get_payload(decode=True), символы вне алфавита base64 пропускаются
+    # Как и get_payload(decode=True), символы вне алфавита base64 пропускаются
+    encoded: str = part.get_payload()
+    pending: str = ''
+    for start in range(0, len(encoded), _PAYLOAD_CHUNK):
+        pending += _BASE64_NOISE.sub('', encoded[start:start + _PAYLOAD_CHUNK])
+        padding = pending.find('=')
+        if padding != -1:
+            pending = pending[:padding]
+            break
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield binascii.a2b_base64(pending[:usable])
+            pending = pending[usable:]
+
+    if len(pending) % 4 == 1:
+        pending = pending[:-1]
+    if pending:
+        yield binascii.a2b_base64(pending + '=' * (-len(pending) % 4))
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
 
 
 class IMAPClientWrapper:
-    def __init__(self, server: str, port: int, use_ssl: bool = True):
+    # Серверы (например, iCloud) рвут простаивающее соединение примерно через 30 минут
+    IDLE_TIMEOUT: float = 25 * 60
+    SAVE_WORKERS: int = 8
+    MESSAGE_CACHE_SIZE: int = 128
+    PARSE_TIMEOUT: int = 5
+    PREVIEW_OCTETS: int = 4096
+    # Команды, которые безопасно повторить после обрыва: они ничего не меняют на сервере
+    RETRY_COMMANDS: frozenset[str] = frozenset({'fetch', 'search', 'select_folder', 'list_folders'})
+
+    def __init__(self, server: str, port: int, use_ssl: bool = True, batch_size: int = 100):
         self.server: str = server
         self.port: int = port
         self.use_ssl: bool = use_ssl
+        self.batch_size: int = batch_size
         self.client: IMAPClient | None = None
+        self.current_folder: str | None = None
+        self._exists: int | None = None
+        self.last_used: float = time.monotonic()
+        self._credentials: tuple[str, str] | None = None
+        self._msg_cache: OrderedDict[tuple[str | None, int], Message] = OrderedDict()
+        self._idling: bool = False
+        self._new_mail: bool = False
+        self._known_ids: list[int] | None = None
+        self._known_query: tuple[tuple[str, ...], int] | None = None
+        self._listed: dict[int, EnvelopeRow] = {}
+        self._uidvalidity: int | None = None
 
     def connect(self) -> None:
         print(f"Connecting to {self.server}...")
@@ -34,8 +166,17 @@ class IMAPClientWrapper:
             print("Error: Not connected to the server. Call 'connect' first.")
             return
 
+        if self._reuse_session(username, password):
+            self._credentials = (username, password)
+            self.last_used = time.monotonic()
+            print("Reusing an existing session, logged in successfully!")
+            return
+
         try:
             self.client.login(username, password)
+            self._credentials = (username, password)
+            _POOL[(self.server, username)] = (self.client, password)
+            self.last_used = time.monotonic()
             print("Logged in successfully!")
         except IMAPClient.Error as e:
             print(f"Login failed: {e}")
@@ -44,50 +185,228 @@ class IMAPClientWrapper:
         except TypeError as e:
             print(f"Type error during login: {e}")
 
+    def _reuse_session(self, username: str, password: str) -> bool:
+        pooled = _POOL.get((self.server, username))
+        if pooled is None or pooled[0] is self.client or pooled[1] != password:
+            return False
+
+        client = pooled[0]
+        try:
+            client.noop()
+        except (IMAPClient.Error, OSError):
+            del _POOL[(self.server, username)]
+            return False
+
+        # Новое соединение еще не авторизовано, поэтому его можно просто закрыть
+        try:
+            self.client.shutdown()
+        except OSError:
+            pass
+        self.client = client
+        return True
+
+    def _call(self, method: str, *args, **kwargs):
+        try:
+            return getattr(self.client, method)(*args, **kwargs)
+        except (IMAPClient.AbortError, OSError) as e:
+            if method not in self.RETRY_COMMANDS:
+                raise
+            print(f"Connection lost ({e}), reconnecting...")
+            self._reconnect()
+            if not self.client:
+                raise IMAPClient.AbortError(f"reconnect failed after: {e}") from e
+            return getattr(self.client, method)(*args, **kwargs)
+
+    def _ensure_alive(self) -> None:
+        if not self.client:
+            return
+
+        self.stop_idle()
+
+        now = time.monotonic()
+        idle = now - self.last_used
+        self.last_used = now
+        if idle < self.IDLE_TIMEOUT:
+            return
+
+        try:
+            self.client.noop()
+        except (IMAPClient.Error, OSError) as e:
+            print(f"Connection lost ({e}), reconnecting...")
+            try:
+                self._reconnect()
+            except (IMAPClient.Error, OSError) as e:
+                print(f"Reconnect failed: {e}")
+                self.client = None
+
+    def _reconnect(self) -> None:
+        self._known_ids = None
+        if self._credentials:
+            _POOL.pop((self.server, self._credentials[0]), None)
+        dead_client = self.client
+        self.connect()
+        if self.client is dead_client:
+            self.client = None
+            return
+        if not self._credentials:
+            return
+        self.login(*self._credentials)
+        if self.current_folder:
+            response = self.client.select_folder(self.current_folder)
+            self._exists = response.get(b'EXISTS')
+            if response.get(b'UIDVALIDITY') != self._uidvalidity:
+                # Сервер перенумеровал письма: прежние UID больше ничего не значат
+                self._uidvalidity = response.get(b'UIDVALIDITY')
+                self._listed = {}
+                self._msg_cache.clear()
+
+    def start_idle(self) -> None:
+        if not self.client or not self.current_folder or self._idling:
+            return
+        if not self.client.has_capability('IDLE'):
+            return
+
+        try:
+            self.client.idle()
+        except (IMAPClient.Error, OSError) as e:
+            print(f"Error starting IDLE: {e}")
+            return
+        self._idling = True
+
+    def stop_idle(self) -> None:
+        if not self._idling:
+            # Без IDLE изменения в папке не отслеживались
+            self._known_ids = None
+            return
+
+        self._idling = False
+        try:
+            _, responses = self.client.idle_done()
+        except (IMAPClient.Error, OSError):
+            self._known_ids = None
+            self.last_used = float('-inf')
+            return
+
+        for response in responses:
+            if len(response) > 1 and response[1] == b'EXISTS':
+                self._exists = response[0]
+                self._new_mail = True
+            elif len(response) > 1 and response[1] == b'EXPUNGE':
+                if self._exists:
+                    self._exists -= 1
+                self._known_ids = None
+
     def list_folders(self) -> None:
+        self._ensure_alive()
         if self.client:
-            folders = self.client.list_folders()
-            for folder in folders:
-                print(f"* {folder[2]}")
+            try:
+                folders = self._call('list_folders')
+            except (IMAPClient.Error, OSError) as e:
+                print(f"Error listing folders: {e}")
+                return
+            if folders:
+                sys.stdout.write('\n'.join(f"* {folder[2]}" for folder in folders) + '\n')
         else:
             print("Not connected!")
 
     def select_folder(self, folder: str) -> None:
+        self._ensure_alive()
         if self.client:
-            self.client.select_folder(folder)
+            try:
+                response = self._call('select_folder', folder)
+            except (IMAPClient.Error, OSError) as e:
+                print(f"Error selecting folder {folder}: {e}")
+                return
+            self._exists, self._uidvalidity = response.get(b'EXISTS'), response.get(b'UIDVALIDITY')
+            # Имя папки входит в ключ каждой записи кеша, поэтому хранится одна его копия
+            self.current_folder = sys.intern(folder)
+            self._msg_cache.clear()
+            self._known_ids = None
+            self._listed = {}
             print(f"Selected folder {folder}")
         else:
             print("Not connected!")
 
-    def fetch_emails(self, download_attachments: bool = False) -> None:
+    def fetch_emails(self, download_attachments: bool = False, criteria: list[str] | None = None,
+                     limit: int = 10) -> None:
+        self._ensure_alive()
         if not self.client:
             print("Not connected!")
             return
 
-        messages = self.fetch_message_ids()
+        messages = self.fetch_message_ids(criteria, limit)
         if messages is None:
             return
 
+        # Письма с тем же UID не меняются, поэтому уже показанные повторно не запрашиваются
+        previous = self._listed
+        new_ids = [msg_id for msg_id in messages if msg_id not in previous]
+        try:
+            envelopes = list(self.fetch_envelopes(new_ids)) if new_ids else []
+            bodies = self.fetch_text_parts({msg_id: structure for msg_id, _, _, structure in envelopes})
+        except (IMAPClient.Error, OSError) as e:
+            print(f"Error fetching emails: {e}")
+            return
+        envelope_date = self.envelope_date
+        envelope_sender = self.envelope_sender
+        envelope_subject = self.envelope_subject
+        fetched: dict[int, EnvelopeRow] = {}
+        for msg_id, envelope, received, structure in envelopes:
+            sender = envelope_sender(envelope)
+            fetched[msg_id] = EnvelopeRow(msg_id, sys.intern(sender) if sender else sender,
+                                          envelope_subject(envelope), envelope_date(envelope, received),
+                                          bodies.get(msg_id, ""), structure)
+        if self._listed is not previous:
+            # Переподключение во время FETCH сменило UIDVALIDITY
+            previous = {}
+        self._listed = {}
         for msg_id in messages:
-            msg = self.fetch_message(msg_id)
-            if msg is None:
-                continue
-
-            date = self.extract_date(msg)
-            sender = self.extract_sender(msg)
-            subject = self.extract_subject(msg)
-            body, attachments = self.extract_body_and_attachments(msg)
-
-            self.print_email_info(date, sender, subject, body)
+            row = previous.get(msg_id) or fetched.get(msg_id)
+            if row:
+                self._listed[msg_id] = row
+
+        format_email_info = self.format_email_info
+        lines = [format_email_info(row.date, row.sender, row.subject, row.body) for row in self._listed.values()]
+        if lines:
+            sys.stdout.write('\n'.join(lines) + '\n')
+
+        if download_attachments:
+            self.download_attachments(messages)
+
+    def download_attachments(self, messages: list[int]) -> None:
+        with_files = [msg_id for msg_id in messages
+                      if msg_id in self._listed and self.has_attachments(self._listed[msg_id].structure)]
+        if not with_files:
+            return
 
-            if download_attachments:
-                self.save_attachments(attachments)
+        extract_attachments = self.extract_attachments
+        all_attachments: list[tuple[str, Message]] = []
+        try:
+            for msg_id, msg in self.fetch_messages_bulk(with_files):
+                all_attachments.extend(extract_attachments(msg))
+        except (IMAPClient.Error, OSError) as e:
+            print(f"Error downloading attachments: {e}")
+            return
+        self.save_attachments(all_attachments)
 
-    def fetch_message_ids(self) -> list[int] | None:
-        limit: int = 10
+    def fetch_message_ids(self, criteria: list[str] | None = None, limit: int = 10) -> list[int] | None:
+        criteria = criteria or ['ALL']
+        query = (tuple(criteria), limit)
         try:
-            messages: list[int] = self.client.search(['ALL'])
-            return messages[:limit]
+            # IDLE не сообщает об изменении флагов, поэтому сохраненный список годится лишь для ALL
+            if criteria == ['ALL'] and self._known_ids is not None and self._known_query == query:
+                messages = self._known_ids
+                if self._new_mail:
+                    last_seen = max(messages, default=0)
+                    new_ids = [msg_id for msg_id in self._call('search', criteria + ['UID', f"{last_seen + 1}:*"])
+                               if msg_id > last_seen]
+                    messages = (messages + new_ids)[-limit:]
+                self._known_ids, self._new_mail = messages, False
+                return messages
+
+            self._new_mail = False
+            self._known_ids, self._known_query = self._search_latest(criteria, limit), query
+            return self._known_ids
         except IMAPClient.Error as e:
             print(f"Error fetching message IDs: {e}")
             return
@@ -95,84 +414,264 @@ class IMAPClientWrapper:
             print("Client is not initialized. Did you forget to connect?")
             return
 
-    def fetch_message(self, msg_id: int):
-        msg_data = self.client.fetch([msg_id], ['RFC822'])
-        return message_from_bytes(msg_data[msg_id][b'RFC822'])
+    def _search_latest(self, criteria: list[str], limit: int) -> list[int]:
+        if criteria != ['ALL']:
+            return self._call('search', criteria)[-limit:]
+        if not self._exists:
+            # Ноль мог устареть, если письма пришли без IDLE
+            return self._call('search', ['ALL'])[-limit:]
+
+        # Последние письма - последние порядковые номера; SEARCH ALL вернул бы id всей папки
+        start = max(self._exists - limit + 1, 1)
+        messages: list[int] = self._call('search', [f"{start}:*"])
+        if len(messages) < limit and start > 1:
+            # Письма удалили без IDLE, и сохраненное EXISTS устарело
+            messages = self._call('search', ['ALL'])
+        return messages[-limit:]
+
+    def fetch_messages_bulk(self, msg_ids: list[int],
+                            batch_size: int | None = None) -> Iterator[tuple[int, Message]]:
+        for chunk in _batched(msg_ids, batch_size or self.batch_size):
+            # Письма из кеша берутся до FETCH: новые записи могут вытеснить их, пока идет цикл
+            cached = {msg_id: msg for msg_id in chunk if (msg := self._cached_message(msg_id)) is not None}
+            missing = [msg_id for msg_id in chunk if msg_id not in cached]
+            raw = self._call('fetch', missing, ['BODY.PEEK[]']) if missing else {}
+            for msg_id in chunk:
+                msg = cached.get(msg_id)
+                if msg is None and msg_id in raw:
+                    msg = self.parse_message(raw[msg_id][b'BODY[]'])
+                    if msg is None:
+                        continue
+                    self._cache_message(msg_id, msg)
+                if msg is not None:
+                    yield msg_id, msg
+
+    def parse_message(self, raw: bytes) -> Message | None:
+        # compat32: новый парсер заголовков квадратичен на испорченных заголовках (bpo-42909)
+        if not hasattr(signal, 'SIGALRM') or threading.current_thread() is not threading.main_thread():
+            return message_from_bytes(raw, policy=policy.compat32)
+
+        def on_timeout(signum, frame):
+            raise TimeoutError
+
+        previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+        signal.alarm(self.PARSE_TIMEOUT)
+        try:
+            return message_from_bytes(raw, policy=policy.compat32)
+        except TimeoutError:
+            print(f"Message parsing took longer than {self.PARSE_TIMEOUT} s, skipped")
+            return
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    def _cached_message(self, msg_id: int) -> Message | None:
+        key = (self.current_folder, msg_id)
+        msg = self._msg_cache.get(key)
+        if msg is not None:
+            self._msg_cache.move_to_end(key)
+        return msg
+
+    def _cache_message(self, msg_id: int, msg: Message) -> None:
+        self._msg_cache[(self.current_folder, msg_id)] = msg
+        if len(self._msg_cache) > self.MESSAGE_CACHE_SIZE:
+            self._msg_cache.popitem(last=False)
+
+    def fetch_envelopes(self, msg_ids: list[int],
+                        batch_size: int | None = None) -> Iterator[tuple[int, Envelope, datetime | None, BodyData]]:
+        for chunk in _batched(msg_ids, batch_size or self.batch_size):
+            raw = self._call('fetch', chunk, ['ENVELOPE', 'INTERNALDATE', 'BODYSTRUCTURE'])
+            for msg_id in chunk:
+                data = raw.get(msg_id)
+                if data is not None:
+                    yield msg_id, data[b'ENVELOPE'], data.get(b'INTERNALDATE'), data[b'BODYSTRUCTURE']
+
+    def fetch_text_parts(self, structures: dict[int, BodyData]) -> dict[int, str]:
+        sections: dict[str, list[int]] = {}
+        parts: dict[int, tuple] = {}
+        for msg_id, structure in structures.items():
+            found = self.find_text_part(structure)
+            if found:
+                section, parts[msg_id] = found
+                sections.setdefault(section, []).append(msg_id)
+
+        bodies: dict[int, str] = {}
+        for section, section_ids in sections.items():
+            key = f'BODY[{section}]<0>'.encode()
+            for ids in _batched(section_ids, self.batch_size):
+                raw = self._call('fetch', ids, [f'BODY.PEEK[{section}]<0.{self.PREVIEW_OCTETS}>'])
+                for msg_id in ids:
+                    data = raw.get(msg_id)
+                    if data is not None and data.get(key):
+                        bodies[msg_id] = self.decode_part(data[key], parts[msg_id])
+        return bodies
+
+    def find_text_part(self, structure: BodyData, prefix: str = '') -> tuple[str, BodyData] | None:
+        if not structure.is_multipart:
+            return prefix or '1', structure
+
+        for i, part in enumerate(structure[0], start=1):
+            section = f"{prefix}.{i}" if prefix else str(i)
+            if part.is_multipart:
+                found = self.find_text_part(part, section)
+                if found:
+                    return found
+            elif (part[0].lower(), part[1].lower()) == (b'text', b'plain') and not self.is_attachment_part(part):
+                return section, part
+        return
 
-    def extract_date(self, msg) -> str | None:
-        date: str | None = msg['Date']
-        if date:
+    def part_disposition(self, part: tuple) -> tuple | None:
+        # Положение disposition в BODYSTRUCTURE зависит от типа части (RFC 3501, 7.4.2)
+        maintype, subtype = part[0].lower(), part[1].lower()
+        if maintype == b'text':
+            index = 9
+        elif (maintype, subtype) == (b'message', b'rfc822'):
+            index = 11
+        else:
+            index = 8
+        disposition = part[index] if len(part) > index else None
+        return disposition if isinstance(disposition, tuple) else None
+
+    def is_attachment_part(self, part: tuple) -> bool:
+        disposition = self.part_disposition(part)
+        return disposition is not None and disposition[0].lower() == b'attachment'
+
+    def has_attachments(self, structure: BodyData) -> bool:
+        return structure.is_multipart and any(self._has_file(part) for part in structure[0])
+
+    def _has_file(self, part: tuple) -> bool:
+        if isinstance(part, BodyData) and part.is_multipart:
+            return any(self._has_file(sub) for sub in part[0])
+        # Вложенное письмо разбирается walk() целиком, поэтому считаем, что файлы в нем есть
+        if (part[0].lower(), part[1].lower()) == (b'message', b'rfc822'):
+            return True
+        # Имя файла - filename в disposition или name в Content-Type, в т.ч. по RFC 2231
+        params = list(part[2] or ())
+        disposition = self.part_disposition(part)
+        if disposition and disposition[1]:
+            params += list(disposition[1])
+        keys = {key.lower().split(b'*')[0] for key in params[::2] if isinstance(key, bytes)}
+        return b'filename' in keys or b'name' in keys
+
+    def decode_part(self, payload: bytes, part: tuple) -> str:
+        encoding: bytes = (part[5] or b'').upper()
+        if encoding == b'BASE64':
+            # Частичный FETCH обрывает base64 посреди группы: лишний символ отбрасываем, остаток дополняем
+            encoded = _BASE64_NOISE.sub('', payload.decode('ascii', errors='ignore')).partition('=')[0]
+            encoded = encoded[:len(encoded) - (len(encoded) % 4 == 1)]
             try:
-                # Парсим дату с помощью dateutil
-                parsed_date = parser.parse(date)
-                return parsed_date.strftime('%Y-%m-%d %H:%M:%S')
-            except ValueError as e:
-                print(f"Error parsing date: {e}")
-        return
+                payload = binascii.a2b_base64(encoded + '=' * (-len(encoded) % 4))
+            except binascii.Error:
+                payload = b''
+        elif encoding == b'QUOTED-PRINTABLE':
+            payload = quopri.decodestring(payload)
+
+        # Имена параметров регистронезависимы: Dovecot присылает ("charset" "koi8-r")
+        raw_params = part[2] or ()
+        params = {key.lower(): value for key, value in zip(raw_params[::2], raw_params[1::2])
+                  if isinstance(key, bytes) and isinstance(value, bytes)}
+        charset = params.get(b'charset', b'utf-8').decode('ascii', errors='ignore')
+        try:
+            return payload.decode(charset, errors='ignore')
+        except LookupError:
+            return payload.decode('utf-8', errors='ignore')
 
-    def extract_sender(self, msg: message_from_bytes) -> str | None:
-        sender: str | None = msg['From']
-        if sender:
-            sender = decode_header(sender)[0][0]
-            if isinstance(sender, bytes):
-                return sender.decode('utf-8', errors='ignore')
+    def envelope_date(self, envelope: Envelope, received: datetime | None = None) -> str | None:
+        date = envelope.date or received
+        if date:
+            return _format_date(date)
         return
 
-    def extract_subject(self, msg: message_from_bytes) -> str | None:
-        subject: str | None = msg['Subject']
-        if subject:
-            subject = decode_header(subject)[0][0]
-            if isinstance(subject, bytes):
-                return subject.decode('utf-8', errors='ignore')
+    def envelope_sender(self, envelope: Envelope) -> str | None:
+        if not envelope.from_:
+            return
+        address = envelope.from_[0]
+        name = _decode(address.name.decode('utf-8', errors='ignore')) if address.name else ''
+        mailbox = (address.mailbox or b'').decode('utf-8', errors='ignore')
+        host = (address.host or b'').decode('utf-8', errors='ignore')
+        email = f"{mailbox}@{host}" if host else mailbox
+        return f"{name} <{email}>" if name else email
+
+    def envelope_subject(self, envelope: Envelope) -> str | None:
+        if envelope.subject:
+            return _decode(envelope.subject.decode('utf-8', errors='ignore'))
         return
 
-    def extract_body_and_attachments(self, msg: message_from_bytes) -> tuple[str, list[tuple[str, bytes]]]:
-        body: str = ""
-        attachments: list[tuple[str, bytes]] = []
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type: str = part.get_content_type()
-
-                if content_type == 'text/plain' and not part.get_filename():
-                    body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-
-                filename: str | None = part.get_filename()
-                if filename:
-                    filename = decode_header(filename)[0][0]
-                    if isinstance(filename, bytes):
-                        filename = filename.decode('utf-8', errors='ignore')
-
-                    file_data: bytes | None = part.get_payload(decode=True)
-                    if file_data:
-                        attachments.append((filename, file_data))
-        else:
-            body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
+    def extract_attachments(self, msg: Message) -> list[tuple[str, Message]]:
+        attachments: list[tuple[str, Message]] = []
+        if not msg.is_multipart():
+            return attachments
 
-        return body, attachments
+        for part in msg.walk():
+            if part.is_multipart():
+                continue
+            filename: str | None = part.get_filename()
+            if filename:
+                attachments.append((_decode(filename), part))
+        return attachments
 
-    def print_email_info(self, date: str | None, sender: str | None, subject: str | None, body: str) -> None:
+    def format_email_info(self, date: str | None, sender: str | None, subject: str | None, body: str) -> str:
         body_text: str = body[:50]
-        print(f"Дата: {date}")
-        print(f"Отправитель: {sender}")
-        print(f"Тема: {subject}")
-        print(f"Первые 50 символов тела сообщения: {body_text}")
-        print("-" * 40)
+        return (f"Дата: {date}\n"
+                f"Отправитель: {sender}\n"
+                f"Тема: {subject}\n"
+                f"Первые 50 символов тела сообщения: {body_text}\n"
+                f"{_SEPARATOR}")
+
+    def save_attachments(self, attachments: Iterable[tuple[str, Message]], save_dir: str = "attachments") -> None:
+        os.makedirs(save_dir, exist_ok=True)
+        failed: list[tuple[str, Exception]] = []
+
+        # Имена выбираются до запуска пула: два потока, пишущие в один путь, перемешали бы файлы
+        named: list[tuple[str, str, Message]] = []
+        used: set[str] = set()
+        for filename, part in attachments:
+            safe_name = _safe_filename(filename)
+            if not safe_name:
+                failed.append((filename, OSError("invalid file name")))
+                continue
+            named.append((filename, _unique_name(safe_name, used), part))
 
-    def save_attachments(self, attachments: list[tuple[str, bytes]], save_dir: str = "attachments") -> None:
-        save_path = Path(save_dir)
-        save_path.mkdir(parents=True, exist_ok=True)
+        def write(attachment: tuple[str, str, Message]) -> str | None:
+            filename, safe_name, part = attachment
 
-        for filename, file_data in attachments:
-            filepath = save_path / filename
-            filepath.write_bytes(file_data)
-            print(f"Attachment saved: {filepath}")
+            try:
+                chunks = _iter_payload(part)
+                first_chunk: bytes = next(chunks, b'')
+                if not first_chunk:
+                    return
+
+                filepath = os.path.join(save_dir, safe_name)
+                fd = os.open(filepath, _WRITE_FLAGS, 0o644)
+                try:
+                    _write_all(fd, first_chunk)
+                    for chunk in chunks:
+                        _write_all(fd, chunk)
+                finally:
+                    os.close(fd)
+                return filepath
+            except (OSError, ValueError) as e:
+                failed.append((filename, e))
+                return
+
+        # Запись на диск отпускает GIL, поэтому вложения сохраняются параллельно
+        with ThreadPoolExecutor(max_workers=self.SAVE_WORKERS) as executor:
+            for filepath in executor.map(write, named):
+                if filepath:
+                    print(f"Attachment saved: {filepath}")
+
+        for filename, e in failed:
+            print(f"Failed to save attachment {filename}: {e}")
 
     def logout(self) -> None:
         if not self.client:
             print("Client is already disconnected.")
             return
 
+        self.stop_idle()
+        if self._credentials:
+            _POOL.pop((self.server, self._credentials[0]), None)
+
         try:
             self.client.logout()
             print("Logged out successfully.")
@@ -182,6 +681,7 @@ class IMAPClientWrapper:
             self.client = None
 
     def upload_email(self, folder: str, subject: str, body: str, recipients: list[str], sender: str) -> None:
+        self._ensure_alive()
         if not self.client:
             print("Not connected!")
             return
@@ -194,7 +694,10 @@ class IMAPClientWrapper:
         msg.set_content(body)
 
         try:
+            # APPEND не повторяется: если сервер уже сохранил письмо, повтор создаст копию
             self.client.append(folder, msg.as_bytes())
+            if folder == self.current_folder:
+                self._known_ids = self._exists = None
             print(f"Email uploaded to folder '{folder}' successfully!")
         except ConnectionError as e:
             print(f"Connection error while uploading email: {e}")
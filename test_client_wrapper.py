@@ -0,0 +1,232 @@
+import base64
+import unittest
+from email import message_from_bytes, policy
+from email.message import Message
+
+from imapclient.response_parser import parse_fetch_response
+from imapclient.response_types import BodyData
+
+from client_wrapper import IMAPClientWrapper, _iter_payload, _safe_filename, _unique_name
+
+
+def make_part(encoded: bytes) -> Message:
+    raw = (b"Content-Type: application/octet-stream\r\n"
+           b"Content-Transfer-Encoding: base64\r\n"
+           b"\r\n" + encoded)
+    return message_from_bytes(raw, policy=policy.compat32)
+
+
+def parse_structure(structure: bytes) -> BodyData:
+    return parse_fetch_response([b'1 (UID 1 BODYSTRUCTURE ' + structure + b')'])[1][b'BODYSTRUCTURE']
+
+
+class FakeClient:
+    def __init__(self, uids: list[int]):
+        self.uids = uids
+        self.searches: list[list[str]] = []
+        self.idle_responses: list[tuple] = []
+
+    def search(self, criteria: list[str]) -> list[int]:
+        self.searches.append(criteria)
+        if criteria[-2:-1] == ['UID']:
+            low = int(criteria[-1].split(':')[0])
+            return [uid for uid in self.uids if uid >= low] or self.uids[-1:]
+        if criteria == ['UNSEEN']:
+            return [uid for uid in self.uids if uid % 2]
+        if criteria == ['ALL']:
+            return list(self.uids)
+        # "n:*" при n больше числа писем все равно включает последнее письмо
+        start = int(criteria[0].split(':')[0])
+        return self.uids[start - 1:] or self.uids[-1:]
+
+    def idle_done(self) -> tuple[bytes, list[tuple]]:
+        return b'Idle terminated', self.idle_responses
+
+    def fetch(self, msg_ids: list[int], data: list[str]) -> dict[int, dict[bytes, bytes]]:
+        self.fetched = msg_ids
+        return {msg_id: {b'BODY[]': b'Subject: %d\r\n\r\nbody' % msg_id} for msg_id in msg_ids}
+
+
+class IterPayloadTest(unittest.TestCase):
+    def assertSameAsGetPayload(self, encoded: bytes) -> None:
+        part = make_part(encoded)
+        self.assertEqual(b''.join(_iter_payload(part)), part.get_payload(decode=True))
+
+    def test_regular_base64(self):
+        data = bytes(range(256)) * 1000
+        self.assertSameAsGetPayload(base64.encodebytes(data))
+
+    def test_missing_padding(self):
+        self.assertSameAsGetPayload(base64.b64encode(b'hello!!').rstrip(b'='))
+
+    def test_stray_characters(self):
+        encoded = base64.encodebytes(b'attachment data' * 10000)
+        self.assertSameAsGetPayload(encoded[:100] + b'!*-' + encoded[100:] + b'~')
+
+    def test_non_ascii_bytes(self):
+        encoded = base64.encodebytes(b'attachment data' * 10000)
+        self.assertSameAsGetPayload(encoded[:70000] + 'ж'.encode('utf-8') + encoded[70000:])
+
+    def test_data_after_padding(self):
+        self.assertSameAsGetPayload(b'QQ==QUJD')
+
+
+class FilenameTest(unittest.TestCase):
+    def test_path_is_dropped(self):
+        self.assertEqual(_safe_filename('../x'), 'x')
+        self.assertEqual(_safe_filename('..\\..\\boot.ini'), 'boot.ini')
+        self.assertEqual(_safe_filename('/etc/passwd'), 'passwd')
+
+    def test_unusable_names(self):
+        for name in ('', '  ', '.', '..', '../..', 'dir/'):
+            self.assertIsNone(_safe_filename(name), name)
+
+    def test_case_insensitive_collisions(self):
+        used: set[str] = set()
+        names = [_unique_name(name, used) for name in ('Report.pdf', 'report.PDF', 'REPORT.pdf', 'notes')]
+        self.assertEqual(names, ['Report.pdf', 'report (1).PDF', 'REPORT (2).pdf', 'notes'])
+
+    def test_generated_name_already_taken(self):
+        used: set[str] = set()
+        names = [_unique_name(name, used) for name in ('a (1).txt', 'a.txt', 'a.txt')]
+        self.assertEqual(names, ['a (1).txt', 'a.txt', 'a (2).txt'])
+
+
+class DecodePartTest(unittest.TestCase):
+    def test_lowercase_charset_parameter(self):
+        text = 'Привет, мир'
+        part = (b'TEXT', b'PLAIN', (b'charset', b'koi8-r'), None, None, b'7BIT', 11, 1)
+        wrapper = IMAPClientWrapper('localhost', 993)
+        self.assertEqual(wrapper.decode_part(text.encode('koi8-r'), part), text)
+
+    def test_base64_with_stray_characters(self):
+        part = (b'TEXT', b'PLAIN', (b'CHARSET', b'utf-8'), None, None, b'BASE64', 20, 1)
+        wrapper = IMAPClientWrapper('localhost', 993)
+        self.assertEqual(wrapper.decode_part(b'SGVs!bG8gd29ybGQh\r\n', part), 'Hello world!')
+        self.assertEqual(wrapper.decode_part(b'SGVsbG8=d29y', part), 'Hello')
+
+
+class BodyStructureTest(unittest.TestCase):
+    BODY = b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL NIL NIL)'
+    HTML = b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 9 1 NIL NIL NIL NIL)'
+
+    def setUp(self):
+        self.wrapper = IMAPClientWrapper('localhost', 993)
+
+    def mixed(self, *parts: bytes) -> BodyData:
+        return parse_structure(b'(' + b''.join(parts) + b' "MIXED" ("BOUNDARY" "x") NIL NIL NIL)')
+
+    def test_text_attachment(self):
+        attached = (b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL '
+                    b'("ATTACHMENT" ("FILENAME" "notes.txt")) NIL NIL)')
+        structure = self.mixed(attached, self.BODY)
+        self.assertEqual(self.wrapper.part_disposition(structure[0][0]), (b'ATTACHMENT', (b'FILENAME', b'notes.txt')))
+        self.assertTrue(self.wrapper.has_attachments(structure))
+        self.assertEqual(self.wrapper.find_text_part(structure)[0], '2')
+
+    def test_basic_attachment(self):
+        alternative = b'(' + self.BODY + self.HTML + b' "ALTERNATIVE" ("BOUNDARY" "y") NIL NIL NIL)'
+        pdf = b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 100 NIL ("ATTACHMENT" ("FILENAME" "a.pdf")) NIL NIL)'
+        structure = self.mixed(alternative, pdf)
+        self.assertTrue(self.wrapper.is_attachment_part(structure[0][1]))
+        self.assertTrue(self.wrapper.has_attachments(structure))
+        self.assertEqual(self.wrapper.find_text_part(structure)[0], '1.1')
+
+    def test_attached_message(self):
+        envelope = b'("Mon, 1 Jan 2024 00:00:00 +0000" "Hi" NIL NIL NIL NIL NIL NIL NIL "<id@x>")'
+        message = (b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 300 ' + envelope + b' ' + self.BODY +
+                   b' 10 NIL ("ATTACHMENT" NIL) NIL NIL)')
+        structure = self.mixed(self.BODY, message)
+        self.assertTrue(self.wrapper.is_attachment_part(structure[0][1]))
+        self.assertTrue(self.wrapper.has_attachments(structure))
+        self.assertEqual(self.wrapper.find_text_part(structure)[0], '1')
+
+    def test_name_only_file(self):
+        part = b'("APPLICATION" "OCTET-STREAM" ("NAME" "report.bin") NIL NIL "BASE64" 10 NIL NIL NIL NIL)'
+        structure = self.mixed(self.BODY, part)
+        self.assertIsNone(self.wrapper.part_disposition(structure[0][1]))
+        self.assertTrue(self.wrapper.has_attachments(structure))
+
+    def test_rfc2231_filename(self):
+        part = (b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 10 NIL '
+                b'("INLINE" ("FILENAME*0*" "utf-8\'\'%D0%BE" "FILENAME*1*" "%D1%82.pdf")) NIL NIL)')
+        structure = self.mixed(self.BODY, part)
+        self.assertFalse(self.wrapper.is_attachment_part(structure[0][1]))
+        self.assertTrue(self.wrapper.has_attachments(structure))
+
+    def test_no_files(self):
+        structure = parse_structure(b'(' + self.BODY + self.HTML + b' "ALTERNATIVE" ("BOUNDARY" "y") NIL NIL NIL)')
+        self.assertFalse(self.wrapper.has_attachments(structure))
+        self.assertEqual(self.wrapper.find_text_part(structure)[0], '1')
+        self.assertFalse(self.wrapper.has_attachments(parse_structure(self.BODY)))
+
+
+class FetchMessageIdsTest(unittest.TestCase):
+    def make_wrapper(self, uids: list[int], exists: int | None) -> IMAPClientWrapper:
+        wrapper = IMAPClientWrapper('localhost', 993)
+        wrapper.client = FakeClient(uids)
+        wrapper.current_folder = 'INBOX'
+        wrapper._exists = exists
+        return wrapper
+
+    def test_searches_only_latest_sequence_numbers(self):
+        wrapper = self.make_wrapper(list(range(101, 131)), 30)
+        self.assertEqual(wrapper.fetch_message_ids(limit=10), list(range(121, 131)))
+        self.assertEqual(wrapper.client.searches, [['21:*']])
+
+    def test_empty_folder(self):
+        wrapper = self.make_wrapper([], 0)
+        self.assertEqual(wrapper.fetch_message_ids(), [])
+        self.assertEqual(wrapper.client.searches, [['ALL']])
+
+    def test_zero_exists_is_rechecked(self):
+        wrapper = self.make_wrapper([5, 6], 0)
+        self.assertEqual(wrapper.fetch_message_ids(), [5, 6])
+
+    def test_stale_exists_after_expunge(self):
+        wrapper = self.make_wrapper(list(range(1, 13)), 20)
+        self.assertEqual(wrapper.fetch_message_ids(limit=10), list(range(3, 13)))
+        self.assertEqual(wrapper.client.searches, [['11:*'], ['ALL']])
+
+    def test_exists_delta_from_idle(self):
+        wrapper = self.make_wrapper(list(range(1, 21)), 20)
+        wrapper.fetch_message_ids(limit=10)
+        wrapper.client.uids += [21, 22]
+        wrapper.client.idle_responses = [(22, b'EXISTS')]
+        wrapper._idling = True
+        wrapper.stop_idle()
+        self.assertEqual(wrapper.fetch_message_ids(limit=10), list(range(13, 23)))
+        self.assertEqual(wrapper.client.searches[-1], ['ALL', 'UID', '21:*'])
+        self.assertEqual(wrapper._exists, 22)
+
+    def test_uid_range_returns_last_message_when_nothing_new(self):
+        wrapper = self.make_wrapper(list(range(1, 21)), 20)
+        wrapper.fetch_message_ids(limit=10)
+        wrapper.client.uids.append(21)
+        wrapper.client.idle_responses = [(21, b'EXISTS')]
+        wrapper._idling = True
+        wrapper.stop_idle()
+        wrapper.client.uids.pop()
+        self.assertEqual(wrapper.fetch_message_ids(limit=10), list(range(11, 21)))
+
+    def test_other_criteria_are_not_reused(self):
+        wrapper = self.make_wrapper(list(range(1, 31)), 30)
+        self.assertEqual(wrapper.fetch_message_ids(['UNSEEN'], limit=3), [25, 27, 29])
+        self.assertEqual(wrapper.fetch_message_ids(['UNSEEN'], limit=3), [25, 27, 29])
+        self.assertEqual(wrapper.client.searches, [['UNSEEN'], ['UNSEEN']])
+
+
+class FetchMessagesBulkTest(unittest.TestCase):
+    def test_cached_messages_survive_eviction(self):
+        wrapper = IMAPClientWrapper('localhost', 993)
+        wrapper.client = FakeClient([])
+        wrapper.current_folder = 'INBOX'
+        wrapper.MESSAGE_CACHE_SIZE = 3
+        list(wrapper.fetch_messages_bulk([1, 2, 3]))
+        messages = list(wrapper.fetch_messages_bulk([4, 5, 6, 1, 2, 3]))
+        self.assertEqual([msg['Subject'] for _, msg in messages], ['4', '5', '6', '1', '2', '3'])
+        self.assertEqual(wrapper.client.fetched, [4, 5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()